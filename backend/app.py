@@ -1,13 +1,21 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from flask_caching import Cache
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.engine import Engine
+import ast
+import hashlib
+import json
 import logging
+import orjson
+import os
+import sqlite3
 from functools import wraps
 import time
 
 from config import Config
-from models import db, Task
-from worker import JobQueue
+from models import db, Task, DataRecord
+from worker import DatasetChangedError, JobQueue
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -24,57 +32,136 @@ CORS(app,
      },
      supports_credentials=True
 )
-cache = Cache(app)
 db.init_app(app)
 
+# Scope the shared cache to this database so deployments sharing a cache
+# directory or Redis instance never serve each other's tasks
+with app.app_context():
+    db_scope = hashlib.sha1(db.engine.url.render_as_string().encode()).hexdigest()[:12]
+app.config['CACHE_DIR'] = os.path.join(Config.CACHE_DIR, db_scope)
+app.config['CACHE_KEY_PREFIX'] = f"narravance:{db_scope}:"
+cache = Cache(app)
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune SQLite for the single-writer, insert-heavy task workload"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in Config.SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
 # Set up logging
 logging.basicConfig(level=Config.LOG_LEVEL, format=Config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
-# Initialize job queue
-job_queue = JobQueue(app)
-job_queue.start_worker()
-
 def create_tables():
-    """Create database tables"""
+    """Create database tables and bring existing ones up to date"""
     with app.app_context():
         db.create_all()
+        # create_all does not alter existing tables, add columns introduced since
+        task_columns = {column['name'] for column in inspect(db.engine).get_columns('task')}
+        if 'dataset_version' not in task_columns:
+            with db.engine.begin() as connection:
+                connection.execute(text("ALTER TABLE task ADD COLUMN dataset_version VARCHAR"))
+        with db.engine.begin() as connection:
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_record_task_date ON data_record (task_id, sale_date)"
+            ))
+        convert_legacy_filters()
         logger.info("Database tables created")
 
+def convert_legacy_filters():
+    """Rewrite task filters stored as Python dict reprs into JSON
+
+    Early rows were saved with str(dict), which the JSON column cannot load.
+    """
+    with db.engine.begin() as connection:
+        rows = connection.execute(
+            text("SELECT id, filters FROM task WHERE filters LIKE :prefix"),
+            {'prefix': "{'%"}
+        ).all()
+        for task_id, filters in rows:
+            try:
+                converted = json.dumps(ast.literal_eval(filters))
+            except (ValueError, SyntaxError):
+                logger.warning("Could not convert filters of task %s: %s", task_id, filters)
+                continue
+            connection.execute(
+                text("UPDATE task SET filters = :filters WHERE id = :id"),
+                {'filters': converted, 'id': task_id}
+            )
+        if rows:
+            logger.info("Converted legacy filters of %d tasks to JSON", len(rows))
+
+# Runs on every startup (python app.py, flask run, WSGI servers) before any query
+create_tables()
+
+# Initialize job queue
+job_queue = JobQueue(app, cache)
+job_queue.start_worker()
+
 # -----------------------------
 # Decorators
 # -----------------------------
-def handle_exceptions(f):
-    """Decorator to handle exceptions and return appropriate responses"""
+def instrumented(f):
+    """Decorator to time an endpoint and turn unhandled exceptions into 500 responses"""
     @wraps(f)
     def wrapper(*args, **kwargs):
+        start_time = time.perf_counter_ns()
         try:
             return f(*args, **kwargs)
         except Exception as e:
-            logger.error(f"Error in {f.__name__}: {str(e)}")
+            logger.exception("Error in %s: %s", f.__name__, e)
             return jsonify({
                 'error': 'Internal server error',
                 'message': str(e)
             }), 500
+        finally:
+            duration_ms = (time.perf_counter_ns() - start_time) / 1e6
+            logger.info("%s took %.2fms", f.__name__, duration_ms)
     return wrapper
 
-def monitor_performance(f):
-    """Decorator to monitor endpoint performance"""
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = f(*args, **kwargs)
-        duration = time.time() - start_time
-        logger.info(f"{f.__name__} took {duration:.2f} seconds")
-        return result
-    return wrapper
+def task_records_query(task_id):
+    """Core select for a task's records, served by the (task_id, sale_date) index"""
+    return (
+        select(DataRecord.__table__)
+        .where(DataRecord.task_id == task_id)
+        .order_by(DataRecord.sale_date)
+    )
+
+def records_persisted(task):
+    """Whether a completed task's records are stored in the data_record table
+
+    This depends on how the task was completed, not on the current
+    PERSIST_RECORDS setting: tasks from before results were kept in memory
+    have no dataset version, and persisted tasks have rows.
+    """
+    if task.dataset_version is None:
+        return True
+    return db.session.execute(
+        select(DataRecord.id).where(DataRecord.task_id == task.id).limit(1)
+    ).first() is not None
+
+def get_task_records(task):
+    """Records of a completed task as plain dicts
+
+    Persisted records are read from the data_record table without
+    constructing ORM objects; all others are materialized from the
+    worker's in-memory dataset.
+    """
+    if not records_persisted(task):
+        return job_queue.get_records(task)
+
+    rows = db.session.execute(task_records_query(task.id))
+    return [DataRecord.to_dict(row) for row in rows]
 
 # -----------------------------
 # API Endpoints
 # -----------------------------
 @app.route(f'{Config.API_PREFIX}/tasks', methods=['POST'])
-@handle_exceptions
-@monitor_performance
+@instrumented
 def create_task():
     """Create a new data processing task"""
     try:
@@ -86,7 +173,7 @@ def create_task():
             }), 400
 
         filters = data.get('filters')
-        logger.info(f"Received task creation request with filters: {filters}")
+        logger.info("Received task creation request with filters: %s", filters)
         
         # Input validation
         if filters and not isinstance(filters, dict):
@@ -102,13 +189,15 @@ def create_task():
         )
         db.session.add(new_task)
         db.session.commit()
-        logger.info(f"Created new task with ID: {new_task.id}")
+        logger.info("Created new task with ID: %s", new_task.id)
+        job_queue.cache_task_state(new_task)
         
         # Add to job queue
         if not job_queue.add_task(new_task.id, filters):
             new_task.status = "failed"
             new_task.error_message = "Queue is full"
             db.session.commit()
+            job_queue.cache_task_state(new_task)
             return jsonify({
                 'error': 'Queue full',
                 'message': 'Server is busy, please try again later'
@@ -119,18 +208,28 @@ def create_task():
             'task': new_task.to_dict()
         }), 201
     except Exception as e:
-        logger.error(f"Error in create_task: {str(e)}", exc_info=True)
+        logger.error("Error in create_task: %s", e, exc_info=True)
         return jsonify({
             'error': 'Server error',
             'message': str(e)
         }), 500
 
 @app.route(f'{Config.API_PREFIX}/tasks/<int:task_id>', methods=['GET'])
-@handle_exceptions
-@monitor_performance
-@cache.memoize(timeout=60)  # Cache results for 1 minute
+@instrumented
 def get_task(task_id):
     """Get task status and data"""
+    # Completed tasks never change, serve their prebuilt body without the DB
+    body = job_queue.get_cached_response(task_id)
+    if body is not None:
+        return Response(body, mimetype='application/json')
+
+    # Pending, in-progress and failed states are written through by the
+    # worker on every status change, so a hit needs no DB query
+    cache_key = Config.TASK_CACHE_KEY.format(task_id=task_id)
+    response = cache.get(cache_key)
+    if response is not None and response['status'] != "completed":
+        return Response(orjson.dumps(response), mimetype='application/json')
+
     task = db.session.get(Task, task_id)
     if not task:
         return jsonify({
@@ -138,26 +237,78 @@ def get_task(task_id):
             'message': 'Task not found'
         }), 404
 
-    response = task.to_dict()
-    
-    # Include data if task is completed
     if task.status == "completed":
-        response['data'] = [record.to_dict() for record in task.records]
-    
-    return jsonify(response)
+        # Completed tasks never change, their body is kept per process (see above)
+        response = task.to_dict()
+        try:
+            response['data'] = get_task_records(task)
+        except DatasetChangedError as e:
+            return jsonify({
+                'error': 'Dataset changed',
+                'message': str(e)
+            }), 409
+        body = orjson.dumps(response)
+        job_queue.cache_response(task.id, body)
+        return Response(body, mimetype='application/json')
+
+    # add() never overwrites, so this read cannot clobber a newer state
+    # the worker wrote after we queried the DB
+    response = task.to_dict()
+    cache.add(cache_key, response, timeout=Config.TASK_CACHE_TIMEOUT)
+    return Response(orjson.dumps(response), mimetype='application/json')
+
+@app.route(f'{Config.API_PREFIX}/tasks/<int:task_id>/records', methods=['GET'])
+@instrumented
+def stream_task_records(task_id):
+    """Stream a completed task's records as newline-delimited JSON"""
+    task = db.session.get(Task, task_id)
+    if not task:
+        return jsonify({
+            'error': 'Not found',
+            'message': 'Task not found'
+        }), 404
+
+    if task.status != "completed":
+        return jsonify({
+            'error': 'Not ready',
+            'message': f'Task is {task.status}'
+        }), 409
+
+    persisted = records_persisted(task)
+    if not persisted:
+        # Resolve the result before streaming starts so a mismatch is still a 409
+        try:
+            job_queue.get_result(task)
+        except DatasetChangedError as e:
+            return jsonify({
+                'error': 'Dataset changed',
+                'message': str(e)
+            }), 409
+
+    def generate():
+        if persisted:
+            rows = db.session.execute(
+                task_records_query(task_id).execution_options(yield_per=Config.STREAM_BATCH_SIZE)
+            )
+            records = (DataRecord.to_dict(row) for row in rows)
+        else:
+            records = job_queue.iter_records(task)
+        for record in records:
+            yield orjson.dumps(record) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route(f'{Config.API_PREFIX}/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'queue_size': job_queue.queue.qsize(),
-        'worker_active': job_queue.worker_thread and job_queue.worker_thread.is_alive()
+        'queue_size': job_queue.qsize(),
+        'worker_active': job_queue.is_active()
     })
 
 # -----------------------------
 # Application Startup
 # -----------------------------
 if __name__ == '__main__':
-    create_tables()
     app.run(debug=True, host='0.0.0.0', port=5001)
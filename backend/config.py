@@ -1,25 +1,56 @@
 import os
+import tempfile
+from sqlalchemy.pool import QueuePool
 
 class Config:
     # Database
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///data.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Keep file-backed connections open between requests and the worker
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "poolclass": QueuePool,
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_pre_ping": True,
+    }
+    if SQLALCHEMY_DATABASE_URI.startswith("sqlite"):
+        # Pooled connections are shared between request and worker threads
+        SQLALCHEMY_ENGINE_OPTIONS["connect_args"] = {"check_same_thread": False}
+    SQLITE_PRAGMAS = [
+        "journal_mode=WAL",
+        "synchronous=NORMAL",
+        "temp_store=MEMORY",
+        "cache_size=-64000",  # 64MB
+        "mmap_size=268435456",  # 256MB
+    ]
 
     # API
     API_PREFIX = '/api/v1'
     CORS_ORIGINS = ['http://localhost:3000']  # Add production URLs as needed
+    STREAM_BATCH_SIZE = 1000  # rows fetched/converted per batch when streaming records
     
     # Data Processing
     DATA_FOLDER = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-    UNIFIED_DATA_PATH = os.path.join(DATA_FOLDER, "unified_cars.csv")
+    UNIFIED_DATA_PATH = os.path.join(DATA_FOLDER, "unified_cars.parquet")
+    UNIFIED_CSV_PATH = os.path.join(DATA_FOLDER, "unified_cars.csv")  # fallback
     
     # Job Queue
     MAX_QUEUE_SIZE = 100
-    WORKER_SLEEP_TIME = 0.1  # seconds
+    WORKER_POOL_SIZE = 4
+    # Completed tasks are served from the in-memory dataset; set to store
+    # every filtered row in the data_record table instead
+    PERSIST_RECORDS = os.getenv('PERSIST_RECORDS', '').lower() in ('1', 'true')
+    TASK_RESULT_CACHE_SIZE = 32  # filtered frames kept in memory
+    FILTER_CACHE_SIZE = 16  # distinct filter sets whose result is reused by new tasks
     
-    # Cache
-    CACHE_TYPE = "SimpleCache"
+    # Cache (shared between processes: Redis if REDIS_URL is set, otherwise on disk)
+    CACHE_REDIS_URL = os.getenv('REDIS_URL')
+    CACHE_TYPE = "RedisCache" if CACHE_REDIS_URL else "FileSystemCache"
+    CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'narravance_cache'))
     CACHE_DEFAULT_TIMEOUT = 300  # 5 minutes
+    TASK_CACHE_TIMEOUT = 60  # seconds
+    TASK_CACHE_KEY = "task:{task_id}"
+    RESPONSE_CACHE_SIZE = 64  # serialized completed-task responses kept per process
     
     # Security
     REQUEST_TIMEOUT = 30  # seconds
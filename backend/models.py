@@ -1,31 +1,26 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-import json
 
 db = SQLAlchemy()
 
 class Task(db.Model):
     """Task model for tracking data processing jobs"""
     id = db.Column(db.Integer, primary_key=True)
-    filters = db.Column(db.String, nullable=True)
+    filters = db.Column(db.JSON(none_as_null=True), nullable=True)
     status = db.Column(db.String, default="pending")  # pending, in_progress, completed, failed
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime, nullable=True)
     error_message = db.Column(db.String, nullable=True)
+    dataset_version = db.Column(db.String, nullable=True)  # unified dataset the results came from
     
     # Relationships
     records = db.relationship('DataRecord', backref='task', lazy=True, cascade='all, delete-orphan')
 
-    def __init__(self, **kwargs):
-        if 'filters' in kwargs and isinstance(kwargs['filters'], dict):
-            kwargs['filters'] = json.dumps(kwargs['filters'])
-        super(Task, self).__init__(**kwargs)
-
     def to_dict(self):
         """Convert task to dictionary format"""
         return {
             'id': self.id,
-            'filters': json.loads(self.filters) if self.filters and self.filters != 'null' else None,
+            'filters': self.filters,
             'status': self.status,
             'created_at': self.created_at.isoformat(),
             'completed_at': self.completed_at.isoformat() if self.completed_at else None,
@@ -34,6 +29,10 @@ class Task(db.Model):
 
 class DataRecord(db.Model):
     """Model for storing processed car data"""
+    __table_args__ = (
+        db.Index('ix_record_task_date', 'task_id', 'sale_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
     
@@ -50,20 +49,22 @@ class DataRecord(db.Model):
     price = db.Column(db.Integer, nullable=True)
     origin = db.Column(db.String, nullable=True)
 
-    def to_dict(self):
-        """Convert record to dictionary format"""
-        return {
-            'id': self.id,
-            'task_id': self.task_id,
-            'company': self.company,
-            'name': self.name,
-            'mpg': self.mpg,
-            'cylinders': self.cylinders,
-            'displacement': self.displacement,
-            'horsepower': self.horsepower,
-            'weight': self.weight,
-            'acceleration': self.acceleration,
-            'sale_date': self.sale_date.isoformat() if self.sale_date else None,
-            'price': self.price,
-            'origin': self.origin
-        } 
\ No newline at end of file
+def compile_to_dict(model):
+    """Generate a to_dict serializer for a model from its table columns
+
+    The generated function reads every column as a direct attribute access and
+    builds the dict literal in one expression. It works on ORM instances as
+    well as Core result rows.
+    """
+    fields = []
+    for column in model.__table__.columns:
+        value = f"r.{column.key}"
+        if isinstance(column.type, db.DateTime):
+            value = f"({value}.isoformat() if {value} else None)"
+        fields.append(f"{column.key!r}: {value}")
+    source = "lambda r: {" + ", ".join(fields) + "}"
+    to_dict = eval(compile(source, f"<{model.__name__}.to_dict>", "eval"))
+    to_dict.__doc__ = "Convert record to dictionary format"
+    return to_dict
+
+DataRecord.to_dict = compile_to_dict(DataRecord)
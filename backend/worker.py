@@ -1,6 +1,6 @@
 import threading
-import queue
-import time
+from collections import OrderedDict, deque
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import logging
@@ -8,16 +8,86 @@ from models import db, Task, DataRecord
 from config import Config
 import os
 import json
+import hashlib
 
 logger = logging.getLogger(__name__)
 
+# Columns copied from the unified dataset into DataRecord rows
+RECORD_COLUMNS = ['company', 'name', 'mpg', 'cylinders', 'displacement', 'horsepower',
+                  'weight', 'acceleration', 'sale_date', 'price', 'origin']
+
+# Float columns of DataRecord, serialized as floats in both record modes
+RECORD_FLOAT_COLUMNS = {
+    column.key: 'float64'
+    for column in DataRecord.__table__.columns
+    if isinstance(column.type, db.Float)
+}
+
+# Column types applied when loading the unified dataset
+UNIFIED_DATA_DTYPES = {
+    'company': 'category',
+    'origin': 'category',
+    'cylinders': 'Int16',
+    'price': 'Int32'
+}
+
+def file_digest(path):
+    """Content version of a file, as 'sha256:<hexdigest>'"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+class DatasetChangedError(Exception):
+    """The unified dataset changed since a task's results were computed"""
+
+class LRUCache:
+    """Small thread-safe mapping that evicts the least recently used entry"""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
 class JobQueue:
     """Thread-safe job queue for handling data processing tasks"""
-    def __init__(self, app):
-        self.queue = queue.Queue(maxsize=Config.MAX_QUEUE_SIZE)
+    def __init__(self, app, cache):
         self.app = app
-        self.worker_thread = None
+        self.cache = cache
+        self.workers = []
+        self._deque = deque()
+        self._not_empty = threading.Event()
+        self._slots = threading.BoundedSemaphore(Config.MAX_QUEUE_SIZE)
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._df_cache = None
+        self._df_version = None
+        self._df_stamp = None
+        self._df_lock = threading.Lock()
+        self._task_results = LRUCache(Config.TASK_RESULT_CACHE_SIZE)
+        self._filtered = LRUCache(Config.FILTER_CACHE_SIZE)  # (dataset version, filters) -> frame
+        self._response_cache = LRUCache(Config.RESPONSE_CACHE_SIZE)  # task_id -> bytes
         self._setup_logging()
+        if self._data_path():
+            self._load_data()
 
     def _setup_logging(self):
         """Configure logging for the worker"""
@@ -26,143 +96,264 @@ class JobQueue:
             format=Config.LOG_FORMAT
         )
 
+    def _data_path(self):
+        """Path of the unified dataset, preferring Parquet over the CSV export"""
+        for path in (Config.UNIFIED_DATA_PATH, Config.UNIFIED_CSV_PATH):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _load_data(self):
+        """Return the unified dataset and its version, re-reading it only when the file changes
+
+        The version is a digest of the file's contents; the mtime is only a
+        cheap signal to re-check it, so touching or copying the file keeps
+        the same version.
+        """
+        path = self._data_path()
+        stamp = (path, os.stat(path).st_mtime_ns)
+        with self._df_lock:
+            if self._df_cache is None or stamp != self._df_stamp:
+                version = file_digest(path)
+                if version != self._df_version:
+                    if path.endswith('.parquet'):
+                        df = pd.read_parquet(path, engine='pyarrow').astype(UNIFIED_DATA_DTYPES)
+                    else:
+                        df = pd.read_csv(
+                            path,
+                            engine='pyarrow',
+                            parse_dates=['sale_date'],
+                            dtype=UNIFIED_DATA_DTYPES
+                        )
+                    self._df_cache = df
+                    self._df_version = version
+                    logger.info("Loaded %d records from %s", len(df), path)
+                self._df_stamp = stamp
+            return self._df_cache, self._df_version
+
     def start_worker(self):
-        """Start the worker thread"""
-        if self.worker_thread is None or not self.worker_thread.is_alive():
-            self.worker_thread = threading.Thread(target=self._process_queue, daemon=True)
-            self.worker_thread.start()
-            logger.info("Worker thread started")
+        """Start the worker threads"""
+        self.workers = [worker for worker in self.workers if worker.is_alive()]
+        while len(self.workers) < Config.WORKER_POOL_SIZE:
+            worker = threading.Thread(
+                target=self._process_queue,
+                name=f"job-worker-{len(self.workers)}",
+                daemon=True
+            )
+            worker.start()
+            self.workers.append(worker)
+        logger.info("%d worker threads running", len(self.workers))
+
+    def is_active(self):
+        """Whether any worker thread is alive"""
+        return any(worker.is_alive() for worker in self.workers)
+
+    def qsize(self):
+        """Number of tasks queued or running"""
+        return self._pending
 
     def add_task(self, task_id, filters):
         """Add a new task to the queue"""
-        try:
-            self.queue.put((task_id, filters), block=False)
-            logger.info(f"Task {task_id} added to queue")
-            return True
-        except queue.Full:
-            logger.error(f"Queue is full, couldn't add task {task_id}")
+        if not self._slots.acquire(blocking=False):
+            logger.error("Queue is full, couldn't add task %s", task_id)
             return False
 
+        with self._pending_lock:
+            self._pending += 1
+        # deque.append is atomic, the event only wakes idle workers
+        self._deque.append((task_id, filters))
+        self._not_empty.set()
+        logger.info("Task %s added to queue", task_id)
+        return True
+
     def _process_queue(self):
         """Main worker loop for processing tasks"""
         while True:
+            self._not_empty.wait()
             try:
-                task_id, filters = self.queue.get(timeout=1)
-                with self.app.app_context():
-                    self._process_task(task_id, filters)
-            except queue.Empty:
-                time.sleep(Config.WORKER_SLEEP_TIME)
-            except Exception as e:
-                logger.error(f"Error in worker thread: {str(e)}")
+                task_id, filters = self._deque.popleft()
+            except IndexError:
+                self._not_empty.clear()
+                # A task may have been appended between popleft and clear
+                if self._deque:
+                    self._not_empty.set()
+                continue
+            self._process_task_with_context(task_id, filters)
+
+    def _release_slot(self):
+        """Free a queue slot once a task has left the pool"""
+        with self._pending_lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _process_task_with_context(self, task_id, filters):
+        """Worker entry point, runs a task inside the application context"""
+        try:
+            with self.app.app_context():
+                self._process_task(task_id, filters)
+        except Exception as e:
+            logger.error("Error in worker thread: %s", e)
+        finally:
+            self._release_slot()
 
     def _process_task(self, task_id, filters):
         """Process a single task"""
-        logger.info(f"Processing task {task_id} with filters: {filters}")
+        logger.info("Processing task %s with filters: %s", task_id, filters)
         
         try:
             # Update task status
             task = db.session.get(Task, task_id)
             if not task:
-                logger.error(f"Task {task_id} not found")
+                logger.error("Task %s not found", task_id)
                 return
 
             task.status = "in_progress"
             db.session.commit()
-            logger.info(f"Task {task_id} status updated to in_progress")
+            self.cache_task_state(task)
+            logger.info("Task %s status updated to in_progress", task_id)
 
             # Check if data file exists
-            if not os.path.exists(Config.UNIFIED_DATA_PATH):
-                error_msg = f"Data file not found at {Config.UNIFIED_DATA_PATH}"
+            if not self._data_path():
+                error_msg = f"Data file not found at {Config.UNIFIED_DATA_PATH} or {Config.UNIFIED_CSV_PATH}"
                 logger.error(error_msg)
                 task.status = "failed"
                 task.error_message = error_msg
                 db.session.commit()
+                self.cache_task_state(task)
                 return
 
-            # Read and process data
-            df = pd.read_csv(Config.UNIFIED_DATA_PATH)
-            logger.info(f"Read {len(df)} records from unified data")
+            df, dataset_version = self._filter_dataset(filters)
+            logger.info("Task %s matched %d records", task_id, len(df))
 
-            # Apply filters if provided
-            if filters:
-                df = self._apply_filters(df, filters)
-                logger.info(f"Applied filters, {len(df)} records remaining")
-
-            # Create records
-            self._create_records(df, task_id)
-            logger.info(f"Created records for task {task_id}")
+            if Config.PERSIST_RECORDS:
+                self._create_records(df, task_id)
+                logger.info("Created records for task %s", task_id)
+            else:
+                self._task_results.set(task_id, df)
 
             # Mark task as completed
             task.status = "completed"
             task.completed_at = datetime.utcnow()
+            task.dataset_version = dataset_version
             db.session.commit()
-            logger.info(f"Task {task_id} completed successfully")
+            self.cache_task_state(task)
+            logger.info("Task %s completed successfully", task_id)
 
         except Exception as e:
-            logger.error(f"Error processing task {task_id}: {str(e)}", exc_info=True)
+            logger.error("Error processing task %s: %s", task_id, e, exc_info=True)
             task.status = "failed"
             task.error_message = str(e)
             db.session.commit()
+            self.cache_task_state(task)
+
+    def cache_task_state(self, task):
+        """Write the task's current state to the shared cache after a status change"""
+        self.cache.set(
+            Config.TASK_CACHE_KEY.format(task_id=task.id),
+            task.to_dict(),
+            timeout=Config.TASK_CACHE_TIMEOUT
+        )
+
+    def get_result(self, task):
+        """Filtered frame for a completed task, recomputed from the dataset on a miss
+
+        Raises DatasetChangedError if the dataset was regenerated after the
+        task completed, rather than returning different rows for it.
+        """
+        df = self._task_results.get(task.id)
+        if df is None:
+            df, dataset_version = self._filter_dataset(task.filters)
+            if dataset_version != task.dataset_version:
+                raise DatasetChangedError(
+                    f"Task {task.id} was computed from {task.dataset_version}, "
+                    f"the current dataset is {dataset_version}"
+                )
+            self._task_results.set(task.id, df)
+        return df
+
+    def _filter_dataset(self, filters):
+        """Apply filters to the cached dataset, which must not be modified in place
+
+        Results are memoized per dataset version and filter set, so tasks
+        submitted with identical filters share one pass over the dataset.
+        """
+        df, dataset_version = self._load_data()
+        key = (dataset_version, json.dumps(filters, sort_keys=True))
+        filtered = self._filtered.get(key)
+        if filtered is None:
+            filtered = self._apply_filters(df, filters) if filters else df
+            self._filtered.set(key, filtered)
+        return filtered, dataset_version
+
+    def get_cached_response(self, task_id):
+        """Serialized GET response of a completed task, if one is cached"""
+        return self._response_cache.get(task_id)
+
+    def cache_response(self, task_id, body):
+        """Remember the serialized GET response of a completed task"""
+        self._response_cache.set(task_id, body)
+
+    def _records_frame(self, df, task_id):
+        """Frame of task results as an object frame laid out like DataRecord.to_dict"""
+        records_df = df.reindex(columns=RECORD_COLUMNS).astype(RECORD_FLOAT_COLUMNS)
+        records_df['sale_date'] = records_df['sale_date'].dt.strftime('%Y-%m-%dT%H:%M:%S')
+        records_df = records_df.astype(object).where(records_df.notna(), None)
+        # Rows are identified by their position in the unified dataset, so
+        # the same row has the same id in every task that matched it
+        records_df.insert(0, 'id', df.index)
+        records_df.insert(1, 'task_id', task_id)
+        return records_df
+
+    def get_records(self, task):
+        """Records of a completed task in the DataRecord.to_dict format"""
+        return self._records_frame(self.get_result(task), task.id).to_dict(orient='records')
+
+    def iter_records(self, task):
+        """Yield a completed task's records one at a time, for streaming
+
+        Rows are converted in slices of STREAM_BATCH_SIZE, so only one slice
+        is ever copied into the object layout.
+        """
+        df = self.get_result(task)
+        for start in range(0, len(df), Config.STREAM_BATCH_SIZE):
+            records_df = self._records_frame(df.iloc[start:start + Config.STREAM_BATCH_SIZE], task.id)
+            columns = records_df.columns.tolist()
+            for values in records_df.itertuples(index=False, name=None):
+                yield dict(zip(columns, values))
 
     def _apply_filters(self, df, filters):
         """Apply filters to the dataframe"""
-        logger.info(f"Applying filters: {filters}")
+        logger.info("Applying filters: %s", filters)
         try:
-            if isinstance(filters, str):
-                filters = json.loads(filters)
-                logger.info(f"Converted string filters to dict: {filters}")
-            
+            mask = np.ones(len(df), dtype=bool)
+
             if 'startDate' in filters:
-                df['sale_date'] = pd.to_datetime(df['sale_date'])
-                df = df[df['sale_date'] >= filters['startDate']]
-                logger.info(f"Applied start date filter: {filters['startDate']}, records remaining: {len(df)}")
-            
+                mask &= df['sale_date'].values >= pd.Timestamp(filters['startDate']).to_datetime64()
+
             if 'endDate' in filters:
-                df['sale_date'] = pd.to_datetime(df['sale_date'])
-                df = df[df['sale_date'] <= filters['endDate']]
-                logger.info(f"Applied end date filter: {filters['endDate']}, records remaining: {len(df)}")
-            
+                mask &= df['sale_date'].values <= pd.Timestamp(filters['endDate']).to_datetime64()
+
             if 'carBrands' in filters and filters['carBrands']:
-                logger.info(f"Available companies in data: {df['company'].unique().tolist()}")
-                logger.info(f"Applying company filter for brands: {filters['carBrands']}")
-                df = df[df['company'].isin(filters['carBrands'])]
-                logger.info(f"After company filter, records remaining: {len(df)}")
-                logger.info(f"Companies in filtered data: {df['company'].unique().tolist()}")
-            
-            return df
+                mask &= df['company'].isin(set(filters['carBrands'])).values
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Companies in filtered data: %s", df['company'][mask].unique().tolist())
+
+            return df[mask]
         except Exception as e:
-            logger.error(f"Error applying filters: {str(e)}", exc_info=True)
+            logger.error("Error applying filters: %s", e, exc_info=True)
             raise
 
     def _create_records(self, df, task_id):
-        """Create DataRecord instances from dataframe"""
-        batch_size = 1000
-        records = []
-        
-        for i, row in df.iterrows():
-            record = DataRecord(
-                task_id=task_id,
-                company=row.get('company'),
-                name=row.get('name'),
-                mpg=row.get('mpg'),
-                cylinders=row.get('cylinders'),
-                displacement=row.get('displacement'),
-                horsepower=row.get('horsepower'),
-                weight=row.get('weight'),
-                acceleration=row.get('acceleration'),
-                sale_date=pd.to_datetime(row.get('sale_date')),
-                price=row.get('price'),
-                origin=row.get('origin')
-            )
-            records.append(record)
-            
-            # Batch commit to improve performance
-            if len(records) >= batch_size:
-                db.session.bulk_save_objects(records)
-                db.session.commit()
-                records = []
-        
-        # Commit any remaining records
-        if records:
-            db.session.bulk_save_objects(records)
-            db.session.commit() 
\ No newline at end of file
+        """Bulk insert DataRecord rows from dataframe in a single transaction"""
+        if df.empty:
+            return
+
+        records_df = df.reindex(columns=RECORD_COLUMNS)
+        records_df['sale_date'] = pd.to_datetime(records_df['sale_date'], errors='coerce')
+        # NaN/NaT are not valid bind parameters, map them to NULL
+        records_df = records_df.astype(object).where(records_df.notna(), None)
+        records_df['task_id'] = task_id
+
+        db.session.execute(DataRecord.__table__.insert(), records_df.to_dict(orient='records'))
+        db.session.commit()
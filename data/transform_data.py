@@ -37,7 +37,7 @@ df_json['sale_date'] = pd.to_datetime(df_json['sale_date'], errors='coerce')
 # Add simulated price column
 df_json['price'] = simulate_price(len(df_json))
 
-df_json['company'] = df_json['name'].str.split().str[0].str.title()
+df_json['company'] = df_json['name'].str.extract(r'^(\S+)', expand=False).str.title()
 
 # --- Process CSV file ---
 csv_path = './mpg.csv'
@@ -46,13 +46,13 @@ df_csv = pd.read_csv(csv_path)
 df_csv = df_csv.rename(columns={'model_year': 'sale_date'})
 
 # Convert sale_date: In the CSV, sale_date is given as a number (like 70 for 1970).
-# We'll convert it to a string date "1970-01-01" then to datetime.
-df_csv['sale_date'] = df_csv['sale_date'].apply(lambda x: f"19{int(x):02d}-01-01")
-df_csv['sale_date'] = pd.to_datetime(df_csv['sale_date'], errors='coerce')
+# We'll build January 1st of that year directly from the year component.
+years = 1900 + df_csv['sale_date'].astype('int16')
+df_csv['sale_date'] = pd.to_datetime(pd.DataFrame({'year': years, 'month': 1, 'day': 1}), errors='coerce')
 
 df_csv['price'] = simulate_price(len(df_csv))
 
-df_csv['company'] = df_csv['name'].str.split().str[0].str.title()
+df_csv['company'] = df_csv['name'].str.extract(r'^(\S+)', expand=False).str.title()
 
 # --- Standardize column order across both dataframes ---
 target_cols = ['company', 'name', 'mpg', 'cylinders', 'displacement', 'horsepower',
@@ -69,4 +69,8 @@ df_combined = df_combined.sort_values(by='sale_date')
 output_path = './unified_cars.csv'
 df_combined.to_csv(output_path, index=False)
 
-print(f"Unified data saved to {output_path}.")
+# Columnar copy loaded by the backend worker (native timestamps, no text parsing)
+parquet_path = './unified_cars.parquet'
+df_combined.to_parquet(parquet_path, index=False, compression='zstd')
+
+print(f"Unified data saved to {output_path} and {parquet_path}.")